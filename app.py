@@ -1,15 +1,32 @@
 import os
-import json
+import functools
+import gzip
+import hashlib
+import heapq
+import html
+import math
+import multiprocessing
 import re
+import threading
 import traceback
-from typing import List, Dict
-
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, fields
+from typing import Any, List, Dict, Tuple
+
+import diskcache
+import mistune
+import orjson
 from dotenv import load_dotenv
-from flask import Flask, request, render_template_string, jsonify
-import pytesseract
-from PIL import Image
+from flask import Flask, Response, request, jsonify, stream_with_context
+from flask.json.provider import JSONProvider
+from werkzeug.exceptions import HTTPException, RequestEntityTooLarge
+from werkzeug.utils import secure_filename
 from openai import OpenAI
 
+import ocr_worker
+
 # ─────────── 环境 & 客户端 ───────────
 load_dotenv()
 
@@ -18,65 +35,260 @@ DEEPSEEK_BASE_URL = os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com")
 if not DEEPSEEK_API_KEY:
     raise RuntimeError("Missing DEEPSEEK_API_KEY in .env")
 
-client = OpenAI(api_key=DEEPSEEK_API_KEY, base_url=DEEPSEEK_BASE_URL)
+# 同步客户端线程安全、连接池复用，由 gthread worker 的多线程提供并发；
+# 超时给个上限，避免卡死的请求一直占着 worker 线程（SDK 默认 600s）
+DEEPSEEK_TIMEOUT = float(os.getenv("DEEPSEEK_TIMEOUT", "120"))
+client = OpenAI(api_key=DEEPSEEK_API_KEY, base_url=DEEPSEEK_BASE_URL, timeout=DEEPSEEK_TIMEOUT)
 MODEL_NAME = "deepseek-chat"
 
 UPLOAD_FOLDER = "uploads"
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
-# Apple Silicon 上 tesseract 常见路径（找得到就用）
-try:
-    if os.path.exists("/opt/homebrew/bin/tesseract"):
-        pytesseract.pytesseract.tesseract_cmd = "/opt/homebrew/bin/tesseract"
-except Exception:
-    pass
+# OCR 放到独立的进程池里跑：图片解码和 OCR 前后的 Python 开销不再占 Web 进程的 GIL，
+# 多核可以同时服务多个上传。工作进程的代码都在 ocr_worker 模块里。
+# 用 spawn 起子进程：请求线程里懒启动进程池时 fork 一个多线程进程可能死锁。
+# 任务函数只依赖 ocr_worker；gunicorn 下子进程不会加载 app.py（python app.py 本地运行时
+# spawn 会把主模块按 __mp_main__ 再导入一次，__main__ 守卫保证不会再起服务）
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", os.cpu_count() or 1))
+_ocr_pool_lock = threading.Lock()
+
+def _new_ocr_pool() -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(
+        max_workers=OCR_WORKERS,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=ocr_worker.init_worker,
+    )
+
+OCR_POOL = _new_ocr_pool()
+
+def run_ocr(blob: bytes) -> str:
+    """在进程池里做 OCR；工作进程崩溃（段错误、被 OOM 杀掉）会让整个池失效，换一个新池重试一次"""
+    global OCR_POOL
+    pool = OCR_POOL
+    try:
+        return pool.submit(ocr_worker.ocr_blob, blob).result()
+    except BrokenProcessPool:
+        with _ocr_pool_lock:
+            # 并发请求可能同时撞上同一个坏池：只有第一个负责替换
+            if OCR_POOL is pool:
+                OCR_POOL = _new_ocr_pool()
+                pool.shutdown(wait=False)
+            pool = OCR_POOL
+        return pool.submit(ocr_worker.ocr_blob, blob).result()
+
+# 上传图片只做留档：直接从内存里的字节做 OCR，写盘丢给后台线程，不挡响应
+_archive_pool = ThreadPoolExecutor(max_workers=1)
+
+def _write_upload(path: str, blob: bytes) -> None:
+    if os.path.exists(path):
+        return
+    try:
+        with open(path, "wb") as out:
+            out.write(blob)
+    except Exception:
+        traceback.print_exc()
+
+def archive_upload(filename: str, blob: bytes) -> None:
+    _archive_pool.submit(_write_upload, os.path.join(UPLOAD_FOLDER, filename), blob)
 
 # ─────────── 读取考纲数据 ───────────
-with open("Syllabus_data.json", "r", encoding="utf-8") as f:
-    SYLLABUS_DATA: List[Dict] = json.load(f)
+# 考纲条目加载后只读：用 slots dataclass 代替 dict，省内存、属性访问更快
+@dataclass(slots=True, frozen=True)
+class Subtopic:
+    name: str = ""
+    code: str = ""
+    weight: float = 1
+    outcomes: Tuple[str, ...] = ()
+    keywords: Tuple[str, ...] = ()
+    formulas: Tuple[str, ...] = ()
+    regex: Tuple[str, ...] = ()
+    examples: Tuple[str, ...] = ()
+    book_pages: str = ""
+
+@dataclass(slots=True, frozen=True)
+class Entry:
+    topic: str = ""
+    syllabus_reference: str = ""
+    book: str = ""
+    chapter: str = ""
+    page_range: str = ""
+    weight: float = 1
+    reference_link: str = ""
+    keywords: Tuple[str, ...] = ()
+    subtopics: Tuple[Subtopic, ...] = ()
+
+# JSON 里多出来的键直接忽略，缺的展示字段走默认值，不因数据文件增减字段而启动失败
+_SUBTOPIC_FIELDS = frozenset(f.name for f in fields(Subtopic))
+_ENTRY_FIELDS = frozenset(f.name for f in fields(Entry))
+
+def _freeze(raw: Dict, known: frozenset) -> Dict:
+    return {k: tuple(v) if isinstance(v, list) else v for k, v in raw.items() if k in known}
+
+def load_entry(raw: Dict) -> Entry:
+    subs = tuple(Subtopic(**_freeze(sub, _SUBTOPIC_FIELDS)) for sub in raw.get("subtopics", []))
+    return Entry(**{**_freeze(raw, _ENTRY_FIELDS), "subtopics": subs})
+
+with open("Syllabus_data.json", "rb") as f:
+    SYLLABUS_DATA: List[Entry] = [load_entry(e) for e in orjson.loads(f.read())]
 
 # ─────────── 简易匹配工具 ───────────
-STOP_WORDS = {
+STOP_WORDS = frozenset({
     "the","and","for","with","that","this","from","they","their","them","which",
     "such","into","also","been","were","have","has","had","are","was","but","not",
     "can","use","using","between","within","you","your","what","how","why","when","where","who"
-}
-_token_re = re.compile(r"[A-Za-z]+")
-
-def tokenize(text: str) -> List[str]:
-    tokens = _token_re.findall(text.lower())
-    return [t for t in tokens if t not in STOP_WORDS and len(t) > 2]
-
-def search_syllabus(query: str, data: List[Dict]) -> List[Dict]:
-    q_tokens = tokenize(query)
-    hits = []
+})
+# 除 a-z 以外的字节一律映射成空格；非 ASCII 字符先 encode 成 "?"，同样变成分隔符。
+# 等价于在小写文本上 findall [a-z]+，但 bytes.translate + split 比正则快
+_token_table = bytes(c if 97 <= c <= 122 else 32 for c in range(256))
+
+# 停用词表和转换表绑成默认参数：热路径上走局部变量查找，不再查全局
+def tokenize(text: str, _stop=STOP_WORDS, _table=_token_table) -> List[str]:
+    words = text.lower().encode("ascii", "replace").translate(_table).decode("ascii").split()
+    return [t for t in words if len(t) > 2 and t not in _stop]
+
+# IDF 低于此值的词几乎出现在所有条目里，区分度太低，直接不进索引（动态停用词）
+MIN_IDF = 1.5
+
+def build_inverted_index(data: List[Entry]) -> Dict[str, Tuple[Tuple[int, float, int], ...]]:
+    """token -> [(entry_idx, weight × IDF, sub_idx)]，sub_idx 为 -1 表示条目本身的关键词"""
+    entry_toks = []
+    df: Dict[str, int] = defaultdict(int)
     for entry in data:
-        weight = entry.get("weight", 1)
-        e_tokens = tokenize(" ".join(entry.get("keywords", [])))
-        score = sum(weight for t in q_tokens if t in e_tokens)
-
-        matched_sub = []
-        for sub in entry.get("subtopics", []):
-            st = tokenize(" ".join(sub.get("keywords", [])))
-            sub_score = sum(weight for t in q_tokens if t in st)
-            if sub_score:
-                score += sub_score
-                matched_sub.append(sub.get("name"))
-
-        if score:
-            hits.append((score, entry, matched_sub))
-
-    hits.sort(reverse=True, key=lambda x: x[0])
+        toks = set(tokenize(" ".join(entry.keywords)))
+        sub_toks = [set(tokenize(" ".join(sub.keywords))) for sub in entry.subtopics]
+        entry_toks.append((toks, sub_toks))
+        for t in toks.union(*sub_toks):
+            df[t] += 1
+
+    # W = log2(N) - log2(n) + 1
+    n_docs = len(data)
+    idf = {t: math.log2(n_docs) - math.log2(n) + 1 for t, n in df.items()}
+
+    index: Dict[str, List[Tuple[int, float, int]]] = defaultdict(list)
+    for i, (entry, (toks, sub_toks)) in enumerate(zip(data, entry_toks)):
+        weight = entry.weight
+        for t in toks:
+            if n_docs > 1 and idf[t] < MIN_IDF:
+                continue
+            index[t].append((i, weight * idf[t], -1))
+        for j, st in enumerate(sub_toks):
+            for t in st:
+                if n_docs > 1 and idf[t] < MIN_IDF:
+                    continue
+                index[t].append((i, weight * idf[t], j))
+    # 建完即冻结成紧凑的 tuple：不再预留扩容空间，查询时只读遍历
+    return {t: tuple(postings) for t, postings in index.items()}
+
+# 考纲只在启动时读一次、之后不再修改：倒排索引也只建一次
+INVERTED = build_inverted_index(SYLLABUS_DATA)
+
+def search_syllabus(query: str) -> List[Dict]:
+    # 索引下标指向 SYLLABUS_DATA，两者一起使用，不接受外部传入的数据
+    scores: Dict[int, float] = defaultdict(float)
+    matched: Dict[int, set] = defaultdict(set)
+    for t in set(tokenize(query)):
+        for i, weight, j in INVERTED.get(t, ()):
+            scores[i] += weight
+            if j >= 0:
+                matched[i].add(j)
+
+    hits = [(scores[i], i) for i in sorted(scores)]
+    top = heapq.nlargest(8, hits, key=lambda x: x[0])
 
     result = []
-    for score, entry, matched_sub in hits[:8]:
-        e = entry.copy()
-        e["score"] = score
-        if matched_sub:
-            e["matched_subtopics"] = matched_sub
-        result.append(e)
+    for score, i in top:
+        entry = SYLLABUS_DATA[i]
+        # 只取页面 / API 用得到的字段，不整条拷贝（子条目、教学目标等都不需要）
+        result.append({
+            "topic": entry.topic,
+            "syllabus_reference": entry.syllabus_reference,
+            "book": entry.book,
+            "chapter": entry.chapter,
+            "page_range": entry.page_range,
+            "keywords": entry.keywords[:4],
+            "score": round(score, 2),
+            "matched_subtopics": [entry.subtopics[j].name for j in sorted(matched[i])],
+        })
     return result
 
+# 同一段题干的匹配结果直接复用
+@functools.lru_cache(maxsize=1024)
+def match_syllabus(ocr_text: str) -> List[Dict]:
+    return search_syllabus(ocr_text)
+
+# ─────────── 结果缓存（OCR / 解答） ───────────
+class LRUCache:
+    """线程安全的小型 LRU：超出 maxsize 时淘汰最久未用的条目"""
+
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+class TieredCache:
+    """内存 LRU 挡在前面，diskcache 落盘在后：重启后仍在，多个 gunicorn worker 之间也共享"""
+
+    def __init__(self, directory: str, maxsize: int, size_limit: int):
+        self._lru = LRUCache(maxsize=maxsize)
+        self._disk = diskcache.Cache(directory, size_limit=size_limit)
+
+    def get(self, key: str):
+        value = self._lru.get(key)
+        if value is None:
+            value = self._disk.get(key)
+            if value is not None:
+                self._lru.put(key, value)
+        return value
+
+    def put(self, key: str, value: Any) -> None:
+        self._lru.put(key, value)
+        self._disk.set(key, value)
+
+CACHE_DIR = "cache"
+
+# 图片内容哈希 -> OCR 原文：同一张图重复上传（重试、双击）时跳过 Tesseract。
+# 目录名带上 OCR 参数指纹：调整缩放/语言/引擎参数后自动换一个空缓存，不再返回旧参数的识别结果
+# （key 仍是纯图片哈希，/stream 和留档文件名照旧）
+OCR_CACHE = TieredCache(
+    os.path.join(CACHE_DIR, f"ocr-{ocr_worker.OCR_VERSION}"), maxsize=256, size_limit=64 * 1024 * 1024
+)
+
+# OCR 原文哈希 -> DeepSeek 解答：不同图片只要识别出同样的题干也能命中
+ANSWER_CACHE = TieredCache(os.path.join(CACHE_DIR, "answers"), maxsize=1024, size_limit=256 * 1024 * 1024)
+
+def image_key(blob: bytes) -> str:
+    return hashlib.blake2b(blob, digest_size=16).hexdigest()
+
+def answer_key(kind: str, ocr_text: str) -> str:
+    # 网页流式和 JSON API 的提示词不同，答案分开存
+    return f"{kind}:{hashlib.sha256(ocr_text.encode('utf-8')).hexdigest()}"
+
+def ocr_upload(filename: str, blob: bytes) -> Tuple[str, str]:
+    """返回 (图片内容哈希, OCR 原文)；哈希即 /stream 用来取题干的 key"""
+    key = image_key(blob)
+    ocr_text = OCR_CACHE.get(key)
+    if ocr_text is None:
+        # 留档文件名用内容哈希，同一张图只存一份；客户端文件名只取清洗过的扩展名，杜绝路径穿越
+        ext = os.path.splitext(secure_filename(filename or ""))[1].lower()
+        archive_upload(key + ext, blob)
+        ocr_text = run_ocr(blob)
+        OCR_CACHE.put(key, ocr_text)
+    return key, ocr_text
+
 # ─────────── HTML 模板（首页：拖拽/预览/骨架/粒子/主题） ───────────
 INDEX_HTML = r"""
 <!doctype html>
@@ -304,7 +516,7 @@ RESULT_HTML = r"""
 <link rel="preconnect" href="https://fonts.googleapis.com">
 <link href="https://fonts.googleapis.com/css2?family=Inter:wght@400;600;800&family=JetBrains+Mono:wght@400;600&display=swap" rel="stylesheet">
 <script src="https://cdn.jsdelivr.net/npm/gsap@3.12.5/dist/gsap.min.js"></script>
-<script src="https://cdn.jsdelivr.net/npm/marked/marked.min.js"></script>
+{% if answer_html is none %}<script src="https://cdn.jsdelivr.net/npm/marked/marked.min.js"></script>{% endif %}
 <script>
   // MathJax 配置
   window.MathJax = {
@@ -400,34 +612,23 @@ RESULT_HTML = r"""
     <div class="card">
       <h2>对应考纲 <span class="badge">Top {{ syllabus_hits|length }}</span></h2>
       {% if syllabus_hits %}
-        {% for hit in syllabus_hits %}
-          <div class="hit" data-topic="{{ hit.topic }}" data-ref="{{ hit.syllabus_reference }}" data-book="{{ hit.book }}" data-chapter="{{ hit.chapter }}" data-pages="{{ hit.page_range }}" data-score="{{ hit.score }}">
-            <div class="ring"><span>0%</span></div>
-
-            <div>
-              <div><strong>{{ hit.topic }}</strong> <span class="muted">({{ hit.syllabus_reference }})</span></div>
-              <div class="meta">{{ hit.book }}，{{ hit.chapter }}，pp.{{ hit.page_range }}</div>
-              <div class="meta">关键词：{{ ", ".join(hit.keywords[:4]) }}
-                {% if hit.matched_subtopics %} ｜ 子条目：{{ ", ".join(hit.matched_subtopics) }}{% endif %}
-              </div>
-            </div>
-
-            <div>
-              <button class="copy-btn">复制引用</button>
-            </div>
-          </div>
-        {% endfor %}
+        {{ hits_html|safe }}
       {% else %}
         <p class="muted">⚠️ 未匹配到任何考纲条目。</p>
       {% endif %}
     </div>
 
-    <!-- 右侧：AI 解答（Markdown + LaTeX 渲染，先打字再完整渲染） -->
+    <!-- 右侧：AI 解答（流式 Markdown 渲染，结束后 MathJax 排版） -->
     <div class="card">
       <details open>
         <summary><h2>▼ DeepSeek 解答与思路</h2></summary>
+        {% if answer_html is none %}
         <div id="aiTyping" class="md" style="min-height:100px; opacity:.9; font-family:'JetBrains Mono', ui-monospace;"></div>
         <div id="ai" class="md" style="display:none;"></div>
+        {% else %}
+        <div id="aiTyping" class="md" style="display:none;"></div>
+        <div id="ai" class="md">{{ answer_html|safe }}</div>
+        {% endif %}
       </details>
       <h2 style="margin-top:18px;">OCR 识别的题干</h2>
       <pre class="ocr">{{ ocr_text }}</pre>
@@ -480,7 +681,10 @@ RESULT_HTML = r"""
   });
 
   // ====== 反斜杠/转义修复 + Markdown/TeX 渲染 ======
-  const RAW = {{ deepseek_answer | tojson }};
+  const OCR = {{ ocr_text | tojson }};
+  const IMAGE_KEY = {{ image_key | tojson }};
+  // 命中缓存的解答已在服务端渲染成 HTML，只剩 MathJax 排版（MathJax 加载完会自动排整页）
+  const PRERENDERED = {{ (answer_html is not none) | tojson }};
 
   function normalizeMath(s){
     // 1) 压平多重转义（\\\( -> \()
@@ -491,48 +695,192 @@ RESULT_HTML = r"""
       .replace(/\\\\\[/g, '\\[').replace(/\\\\\]/g, '\\]');
 
     // 2) 把 \(…\)/\[…\] 兜底转换为 $…$/$$…$$
-    s = s.replace(/\\\(([^\n]+?)\\\)/g, '\$$1\$');         // inline
-    s = s.replace(/\\\[((?:.|\n)+?)\\\]/g, '\$\$$1\$\$');  // block
+    // （替换串里 $$ 才是字面量 $）
+    s = s.replace(/\\\(([^\n]+?)\\\)/g, '$$$1$$');            // inline
+    s = s.replace(/\\\[((?:.|\n)+?)\\\]/g, '$$$$$1$$$$');     // block
 
     // 3) 去掉算符前多余的反斜杠（不影响 \alpha 等命令）
     s = s.replace(/\\([=+\-*/^()])/g, '$1');
     return s;
   }
 
-  const RAW0 = normalizeMath(RAW);
-
   const typing = document.getElementById('aiTyping');
   const full = document.getElementById('ai');
-  const snippet = RAW0.slice(0, Math.min(800, RAW0.length)); // 先打 800 字符
-
-  // marked 配置：避免奇怪转义
-  marked.setOptions({ gfm:true, breaks:true, headerIds:false, mangle:false });
-
-  let i=0;
-  const speed = 10;
-  const timer = setInterval(()=>{
-    typing.textContent = snippet.slice(0, i+=3);
-    if(i >= snippet.length){
-      clearInterval(timer);
-      full.innerHTML = marked.parse(RAW0);
-      typing.style.display='none';
-      full.style.display='block';
-      if (window.MathJax && window.MathJax.typesetPromise) {
-        if (MathJax.typesetClear) MathJax.typesetClear();
-        MathJax.typesetPromise([full]);
+
+  function renderMarkdown(raw){
+    full.innerHTML = marked.parse(normalizeMath(raw.trim()));
+    typing.style.display='none';
+    full.style.display='block';
+  }
+
+  // 流式过程中每到一段就重渲染 Markdown，按帧合并，一帧最多 parse 一次
+  let latest = '', framePending = false, finished = false;
+  function renderProgress(raw){
+    latest = raw;
+    if(framePending) return;
+    framePending = true;
+    requestAnimationFrame(()=>{ framePending = false; if(!finished) renderMarkdown(latest); });
+  }
+
+  function renderFull(raw){
+    renderMarkdown(raw);
+    if (window.MathJax && window.MathJax.typesetPromise) {
+      if (MathJax.typesetClear) MathJax.typesetClear();
+      MathJax.typesetPromise([full]);
+    }
+  }
+
+  // 解答走 /stream（SSE 帧）：边到边渲染 Markdown，结束后再排版公式
+  async function streamAnswer(){
+    if(!OCR.trim()){ typing.textContent = '⚠️ 未识别到题干文字。'; return; }
+    const res = await fetch('/stream', {
+      method:'POST', headers:{'Content-Type':'application/json'},
+      body: JSON.stringify({key: IMAGE_KEY})
+    });
+    if(!res.ok || !res.body) throw new Error('HTTP ' + res.status);
+
+    const reader = res.body.getReader();
+    const dec = new TextDecoder();
+    let raw = '', buf = '';
+    for(;;){
+      const {value, done} = await reader.read();
+      if(done) break;
+      buf += dec.decode(value, {stream:true});
+      let k;
+      while((k = buf.indexOf('\n\n')) >= 0){
+        const frame = buf.slice(0, k); buf = buf.slice(k + 2);
+        let ev = 'message', data = '';
+        for(const line of frame.split('\n')){
+          if(line.startsWith('event:')) ev = line.slice(6).trim();
+          else if(line.startsWith('data:')) data += line.slice(5).trim();
+        }
+        const val = data ? JSON.parse(data) : '';
+        if(ev === 'error') throw new Error(val);
+        if(ev === 'message'){ raw += val; renderProgress(raw); }
       }
     }
-  }, speed);
+    finished = true;  // 丢弃还没跑的那一帧，免得覆盖掉 MathJax 排好的结果
+    renderFull(raw);
+  }
+  if(!PRERENDERED){
+    // marked 配置：避免奇怪转义
+    marked.setOptions({ gfm:true, breaks:true, headerIds:false, mangle:false });
+    streamAnswer().catch(err => {
+      finished = true;
+      full.style.display='none';
+      typing.style.display='block';
+      typing.textContent = '⚠️ 解答生成失败：' + err.message;
+    });
+  }
 </script>
 """
 
+# 考纲命中卡片是同一段标记重复 N 次：服务端直接拼字符串，比让 Jinja 逐个节点走循环 + 自动转义快，
+# 拼的时候自己做 HTML 转义
+_HIT_ROW = """
+          <div class="hit" data-topic="{topic}" data-ref="{ref}" data-book="{book}" data-chapter="{chapter}" data-pages="{pages}" data-score="{score}">
+            <div class="ring"><span>0%</span></div>
+
+            <div>
+              <div><strong>{topic}</strong> <span class="muted">({ref})</span></div>
+              <div class="meta">{book}，{chapter}，pp.{pages}</div>
+              <div class="meta">关键词：{keywords}{subtopics}
+              </div>
+            </div>
+
+            <div>
+              <button class="copy-btn">复制引用</button>
+            </div>
+          </div>"""
+
+# 与结果页 JS 里的 normalizeMath 保持一致：压平多重转义、\(…\)/\[…\] 转 $…$/$$…$$、去掉算符前多余的反斜杠
+def normalize_math(s: str) -> str:
+    s = re.sub(r"\\\\\\([()\[\]])", r"\\\1", s)
+    s = re.sub(r"\\\\([()\[\]])", r"\\\1", s)
+    s = re.sub(r"\\\(([^\n]+?)\\\)", r"$\1$", s)
+    s = re.sub(r"\\\[(.+?)\\\]", r"$$\1$$", s, flags=re.S)
+    s = re.sub(r"\\([=+\-*/^()])", r"\1", s)
+    return s
+
+_markdown = mistune.create_markdown(escape=True, hard_wrap=True, plugins=["table", "strikethrough"])
+
+# 已缓存的解答直接在服务端转成 HTML（同一份答案只转一次），页面就不用再加载 marked.js
+@functools.lru_cache(maxsize=256)
+def render_answer_html(answer: str) -> str:
+    return _markdown(normalize_math(answer))
+
+def render_hits_html(hits: List[Dict]) -> str:
+    esc = html.escape
+    rows = []
+    for hit in hits:
+        subs = hit.get("matched_subtopics")
+        rows.append(_HIT_ROW.format(
+            topic=esc(hit["topic"]),
+            ref=esc(hit["syllabus_reference"]),
+            book=esc(hit["book"]),
+            chapter=esc(hit["chapter"]),
+            pages=esc(hit["page_range"]),
+            score=hit["score"],
+            keywords=esc(", ".join(hit["keywords"][:4])),
+            subtopics=f" ｜ 子条目：{esc(', '.join(subs))}" if subs else "",
+        ))
+    return "".join(rows)
+
 # ─────────── Flask 应用 ───────────
+class ORJSONProvider(JSONProvider):
+    """jsonify / request.get_json / 模板里的 tojson 统一走 orjson（输出就是 UTF-8，不转义中文）"""
+
+    def dumps(self, obj, **kwargs) -> str:
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs) -> Response:
+        # 直接把 orjson 的 bytes 交给 Response，省一次 decode/encode
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj), mimetype="application/json")
+
 app = Flask(__name__)
-app.config["JSON_AS_ASCII"] = False
+app.json = ORJSONProvider(app)
+# 上传图片上限 16 MB，超出直接 413，避免整块读进内存
+app.config["MAX_CONTENT_LENGTH"] = 16 * 1024 * 1024
+
+@app.errorhandler(RequestEntityTooLarge)
+def too_large(e):
+    if request.path.startswith("/api/"):
+        return jsonify({"error": "File too large (max 16 MB)"}), 413
+    return "File too large (max 16 MB)", 413
+
+# 模板只编译一次：首页是纯静态的，直接缓存渲染结果；结果页缓存编译好的 Template
+INDEX_RENDERED = app.jinja_env.from_string(INDEX_HTML).render()
+RESULT_TMPL = app.jinja_env.from_string(RESULT_HTML)
+
+# 页面内联了大段 CSS/JS：首页预先 gzip 好，其余 HTML/JSON 响应在 after_request 里按需压缩
+INDEX_GZIP = gzip.compress(INDEX_RENDERED.encode("utf-8"), compresslevel=9)
+_COMPRESSIBLE = ("text/html", "application/json")
+
+def _accepts_gzip() -> bool:
+    return request.accept_encodings["gzip"] > 0
+
+@app.after_request
+def compress_response(resp):
+    if resp.mimetype not in _COMPRESSIBLE:
+        return resp
+    resp.vary.add("Accept-Encoding")
+    if resp.direct_passthrough or resp.is_streamed or "Content-Encoding" in resp.headers or not _accepts_gzip():
+        return resp
+    data = resp.get_data()
+    if len(data) >= 500:
+        resp.set_data(gzip.compress(data, compresslevel=6))
+        resp.headers["Content-Encoding"] = "gzip"
+    return resp
 
 @app.route("/")
 def index():
-    return render_template_string(INDEX_HTML)
+    if _accepts_gzip():
+        return Response(INDEX_GZIP, mimetype="text/html", headers={"Content-Encoding": "gzip"})
+    return INDEX_RENDERED
 
 @app.route("/upload", methods=["POST"])
 def upload():
@@ -540,85 +888,154 @@ def upload():
         if "image" not in request.files:
             return "No file uploaded", 400
         f = request.files["image"]
-        path = os.path.join(UPLOAD_FOLDER, f.filename)
-        f.save(path)
 
         # 1) OCR
-        ocr_text = pytesseract.image_to_string(Image.open(path)).strip()
-
-        # 2) DeepSeek：提示词规范 Markdown/TeX，禁止转义
-        system_prompt = (
-            "You are an expert A-Level tutor. Always respond in the user's language. "
-            "Output strictly in Markdown (no code fences). "
-            "Use $...$ for inline math and $$...$$ for display math. "
-            "Do NOT escape backslashes; write LaTeX commands normally (e.g., \\frac, \\sqrt). "
-            "Structure the solution with concise headings and steps. "
-            "Avoid unnecessary prose; keep math clean."
-        )
-        user_prompt = f"请针对这道题目给出**答案**与**详细解题思路**，按“问题重述 / 解题思路 / 详细解答 / 检查与总结 / 最终答案”的结构输出：\n\n{ocr_text}"
-
-        resp = client.chat.completions.create(
-            model=MODEL_NAME,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user",   "content": user_prompt}
-            ],
-            stream=False
-        )
-        deepseek_answer = resp.choices[0].message.content.strip()
+        img_key, ocr_text = ocr_upload(f.filename, f.read())
 
-        # 3) 考纲匹配
-        syllabus_hits = search_syllabus(ocr_text, SYLLABUS_DATA)
+        # 2) 考纲匹配
+        syllabus_hits = match_syllabus(ocr_text)
 
-        # 4) 渲染
-        return render_template_string(
-            RESULT_HTML,
+        # 3) 先把 OCR + 考纲渲染出去，DeepSeek 解答由页面再走 /stream 流式拉取
+        cached_answer = ANSWER_CACHE.get(answer_key("stream", ocr_text))
+        return RESULT_TMPL.render(
+            answer_html=render_answer_html(cached_answer) if cached_answer is not None else None,
             ocr_text=ocr_text,
-            deepseek_answer=deepseek_answer,
-            syllabus_hits=syllabus_hits
+            image_key=img_key,
+            syllabus_hits=syllabus_hits,
+            hits_html=render_hits_html(syllabus_hits)
         )
+    except HTTPException:
+        # 读 request.files 时超出 MAX_CONTENT_LENGTH 会抛 413：交给 errorhandler，不当成 500
+        raise
     except Exception as e:
         traceback.print_exc()
         return f"Server Error: {e}", 500
 
+def _sse(data, event: str = None) -> str:
+    head = f"event: {event}\n" if event else ""
+    return f"{head}data: {orjson.dumps(data).decode()}\n\n"
+
+@app.route("/stream", methods=["POST"])
+def stream():
+    # 只接受 /upload 给出的图片 key，题干从 OCR 缓存里取：不让任意文本借用 DeepSeek 密钥
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict) or not isinstance(payload.get("key"), str):
+        return "Bad request", 400
+    ocr_text = OCR_CACHE.get(payload["key"])
+    if ocr_text is None:
+        return "Unknown image key", 404
+    ocr_text = ocr_text.strip()
+    if not ocr_text:
+        return "No OCR text", 400
+
+    key = answer_key("stream", ocr_text)
+
+    # DeepSeek：提示词规范 Markdown/TeX，禁止转义
+    system_prompt = (
+        "You are an expert A-Level tutor. Always respond in the user's language. "
+        "Output strictly in Markdown (no code fences). "
+        "Use $...$ for inline math and $$...$$ for display math. "
+        "Do NOT escape backslashes; write LaTeX commands normally (e.g., \\frac, \\sqrt). "
+        "Structure the solution with concise headings and steps. "
+        "Avoid unnecessary prose; keep math clean."
+    )
+    user_prompt = f"请针对这道题目给出**答案**与**详细解题思路**，按“问题重述 / 解题思路 / 详细解答 / 检查与总结 / 最终答案”的结构输出：\n\n{ocr_text}"
+
+    def generate():
+        cached = ANSWER_CACHE.get(key)
+        if cached is not None:
+            yield _sse(cached)
+            yield _sse("", event="done")
+            return
+        try:
+            parts = []
+            finish_reason = None
+            resp = client.chat.completions.create(
+                model=MODEL_NAME,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user",   "content": user_prompt}
+                ],
+                stream=True
+            )
+            for chunk in resp:
+                if not chunk.choices:
+                    continue
+                choice = chunk.choices[0]
+                finish_reason = choice.finish_reason or finish_reason
+                if choice.delta.content:
+                    parts.append(choice.delta.content)
+                    yield _sse(parts[-1])
+            # 只缓存完整结束的回答：被 length/content_filter 截断或空回答不写缓存，下次重新生成
+            answer = "".join(parts).strip()
+            if answer and finish_reason == "stop":
+                ANSWER_CACHE.put(key, answer)
+            yield _sse("", event="done")
+        except Exception as e:
+            traceback.print_exc()
+            yield _sse(str(e), event="error")
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# 请求内的并行小任务共用一个常驻线程池，不用每个请求现建现拆
+EXECUTOR = ThreadPoolExecutor(max_workers=4)
+
+def call_deepseek(ocr_text: str) -> str:
+    key = answer_key("api", ocr_text)
+    cached = ANSWER_CACHE.get(key)
+    if cached is not None:
+        return cached
+
+    system_prompt = (
+        "You are an expert A-Level tutor. Always respond in the user's language. "
+        "Output strictly in Markdown (no code fences). "
+        "Use $...$ for inline math and $$...$$ for display math. "
+        "Do NOT escape backslashes; write LaTeX commands normally."
+    )
+    user_prompt = f"请针对这道题目给出答案和详细解题思路：\n{ocr_text}"
+
+    resp = client.chat.completions.create(
+        model=MODEL_NAME,
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user",   "content": user_prompt}
+        ],
+        stream=False
+    )
+    choice = resp.choices[0]
+    answer = (choice.message.content or "").strip()
+    if answer and choice.finish_reason == "stop":
+        ANSWER_CACHE.put(key, answer)
+    return answer
+
 @app.route("/api/upload", methods=["POST"])
 def api_upload():
     try:
         if "image" not in request.files:
             return jsonify({"error": "No file uploaded"}), 400
         f = request.files["image"]
-        path = os.path.join(UPLOAD_FOLDER, f.filename)
-        f.save(path)
+        _, ocr_text = ocr_upload(f.filename, f.read())
 
-        ocr_text = pytesseract.image_to_string(Image.open(path)).strip()
-
-        system_prompt = (
-            "You are an expert A-Level tutor. Always respond in the user's language. "
-            "Output strictly in Markdown (no code fences). "
-            "Use $...$ for inline math and $$...$$ for display math. "
-            "Do NOT escape backslashes; write LaTeX commands normally."
-        )
-        user_prompt = f"请针对这道题目给出答案和详细解题思路：\n{ocr_text}"
-
-        resp = client.chat.completions.create(
-            model=MODEL_NAME,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user",   "content": user_prompt}
-            ],
-            stream=False
-        )
-        deepseek_answer = resp.choices[0].message.content.strip()
-        syllabus_hits = search_syllabus(ocr_text, SYLLABUS_DATA)
+        # DeepSeek（网络）与考纲匹配（CPU）互不依赖：匹配丢到线程池，本线程直接发 DeepSeek 请求
+        fut_syl = EXECUTOR.submit(match_syllabus, ocr_text)
+        deepseek_answer = call_deepseek(ocr_text)
+        syllabus_hits = fut_syl.result()
 
         return jsonify({
             "ocr_text": ocr_text,
             "deepseek_answer": deepseek_answer,
             "syllabus_hits": syllabus_hits
         })
+    except HTTPException:
+        raise
     except Exception as e:
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
 if __name__ == "__main__":
-    app.run(debug=True)
+    # 本地开发用；debug（reloader + 调试中间件）需显式 FLASK_DEBUG=1 打开，线上走 gunicorn
+    app.run(debug=os.getenv("FLASK_DEBUG") == "1")
@@ -0,0 +1,64 @@
+"""OCR 工作进程用到的全部代码。
+
+单独成模块、只依赖 PIL / pytesseract（可选 tesserocr）：进程池用 spawn 启动子进程，
+子进程反序列化任务时只需导入本模块，不会把 app.py（Flask、DeepSeek 客户端、考纲索引）整个再加载一遍。
+"""
+import hashlib
+import io
+import os
+
+# Tesseract 自带的 OpenMP 多线程开销大于收益：单张图只用一个线程，并行交给多请求 / OCR 进程池。
+# 必须在加载 tesseract 之前设置（OCR 子进程会继承）
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+import pytesseract
+from PIL import Image, ImageOps
+
+# Apple Silicon 上 tesseract 常见路径（找得到就用）
+try:
+    if os.path.exists("/opt/homebrew/bin/tesseract"):
+        pytesseract.pytesseract.tesseract_cmd = "/opt/homebrew/bin/tesseract"
+except Exception:
+    pass
+
+# 只用 LSTM 引擎（--oem 1，跳过 legacy），题图按单一文本块切分（--psm 6），语言固定英文，
+# 跳过版面/方向自动检测
+TESS_LANG = "eng"
+TESS_CONFIG = "--oem 1 --psm 6"
+OCR_MAX_SIDE = 1600
+
+# 预处理流程（ocr_image 里的缩放/灰度/对比度）改动时手动加一
+OCR_PIPELINE_REV = 1
+
+# 识别参数的指纹：任何一项改了，磁盘上按旧参数识别的 OCR 缓存就不能再用
+OCR_VERSION = hashlib.blake2b(
+    f"{OCR_PIPELINE_REV}|{TESS_LANG}|{TESS_CONFIG}|{OCR_MAX_SIDE}".encode("utf-8"), digest_size=4
+).hexdigest()
+
+# 每个工作进程装了 tesserocr 就常驻一个 PyTessBaseAPI
+# （省掉每次 fork tesseract + 重新加载语言模型），没装则回退到 pytesseract。
+_tess_api = None
+
+def init_worker() -> None:
+    global _tess_api
+    try:
+        from tesserocr import PyTessBaseAPI, OEM, PSM
+        _tess_api = PyTessBaseAPI(lang=TESS_LANG, oem=OEM.LSTM_ONLY, psm=PSM.SINGLE_BLOCK)
+    except Exception:
+        _tess_api = None
+
+def ocr_image(img: Image.Image) -> str:
+    # 手机照片动辄 4000×3000，而题目图的识别质量在 ~1600px 就到顶了，先等比缩小。
+    # JPEG 用 draft 直接按 1/2、1/4… 的比例解码成灰度，大图连完整解码都省掉
+    img.draft("L", (OCR_MAX_SIDE, OCR_MAX_SIDE))
+    img.thumbnail((OCR_MAX_SIDE, OCR_MAX_SIDE), Image.Resampling.LANCZOS)
+    # 只做灰度 + 自动对比度：省掉 Tesseract 内部的彩色二值化，更激进的预处理反而可能伤准确率
+    img = ImageOps.autocontrast(img.convert("L"))
+    if _tess_api is None:
+        return pytesseract.image_to_string(img, lang=TESS_LANG, config=TESS_CONFIG).strip()
+    # 工作进程一次只跑一个任务，独占自己的 API 实例
+    _tess_api.SetImage(img)
+    return _tess_api.GetUTF8Text().strip()
+
+def ocr_blob(blob: bytes) -> str:
+    return ocr_image(Image.open(io.BytesIO(blob)))